@@ -5,13 +5,17 @@ import json
 import time
 import secrets
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Optional, Tuple
 
 from flask import (
     Flask, request, redirect, url_for, jsonify,
-    render_template_string, abort, session, g
+    render_template, abort, session, g, has_app_context
 )
+from markupsafe import escape
 
 from dotenv import load_dotenv
 load_dotenv()  # .envファイルを自動読み込み
@@ -22,6 +26,7 @@ import httpx  # OpenAI呼び出しを安定させるためにhttpxを採用
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import hashlib
+import hmac
 
 # -----------------------------
 # 環境変数
@@ -34,6 +39,9 @@ BIND_PORT = int(os.getenv("BIND_PORT", "8080"))
 DB_PATH = os.getenv("DB_PATH", os.path.join(BASE_DIR, "data", "app.db"))
 INDEX_HTML_PATH = os.getenv("INDEX_HTML_PATH", os.path.join(BASE_DIR, "index.html"))
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL")  # 例: https://yourdomain/p/
+PW_HASH_METHOD = os.getenv("PW_HASH", "scrypt:32768:8:1")  # werkzeug の method 指定
+PW_HASH_WORKERS = int(os.getenv("PW_HASH_WORKERS", str(os.cpu_count() or 1)))  # 同時に走らせるハッシュ計算の上限
+REDIS_URL = os.getenv("REDIS_URL")  # 例: redis://localhost:6379/0（未設定なら署名付きCookieセッション）
 
 # -----------------------------
 # Flask アプリ
@@ -43,23 +51,66 @@ app = Flask(__name__)
 # セッション用シークレットキー（未設定なら暫定生成）
 app.secret_key = os.getenv("FLASK_SECRET_KEY") or os.urandom(24)
 
+# サーバーサイドセッション（REDIS_URL と flask-session / redis が揃っているときだけ）
+_REDIS = None
+if REDIS_URL:
+    try:
+        import redis  # type: ignore
+        from flask_session import Session  # type: ignore
+        _REDIS = redis.Redis.from_url(REDIS_URL)
+        app.config.update(SESSION_TYPE="redis", SESSION_REDIS=_REDIS)
+        Session(app)
+    except ImportError:
+        _REDIS = None
+
+# JSON は orjson があればそれでエンコードする（無ければ Flask 標準のまま）
+try:
+    import orjson  # type: ignore
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            option = orjson.OPT_NON_STR_KEYS
+            if kwargs.get("sort_keys", self.sort_keys):
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode("utf-8")
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+except ImportError:
+    pass
+
 # -----------------------------
 # サニタイズ（任意のローカル実装にフォールバック）
 # -----------------------------
+# 制御文字（タブ/改行/CR 以外）を空白へ。str.translate は C の1文字置換なので正規表現より軽い
+_CTRL_TABLE = str.maketrans({c: " " for c in range(32) if c not in (9, 10, 13)})
+_EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+_TEL_RE   = re.compile(r"\b(\+?\d{1,3}[- ]?)?\d{2,4}[- ]?\d{2,4}[- ]?\d{3,4}\b")
+_DIGIT_RE = re.compile(r"\d")
+_ADDR_PREFIXES = ("東京都", "大阪府", "福岡県", "北海道", "京都府", "神奈川県", "愛知県", "埼玉県", "千葉県", "兵庫県", "福岡市", "横浜市")
+_ADDR_RE  = re.compile("(" + "|".join(_ADDR_PREFIXES) + r")[^\n、，。 ]{0,20}")
+
 def _fallback_sanitize(text: str) -> str:
     """最低限の整形。過度に削らない。"""
     if text is None:
         return ""
-    text = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f]", " ", text)  # 制御文字
-    return text.strip()
+    return text.translate(_CTRL_TABLE).strip()
 
 def _mask_pii(text: str) -> str:
     """公開ページ用の簡易マスク（メール・電話・住所らしきもの）"""
     if not text:
         return text
-    text = re.sub(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}", "[email masked]", text)
-    text = re.sub(r"\b(\+?\d{1,3}[- ]?)?\d{2,4}[- ]?\d{2,4}[- ]?\d{3,4}\b", "[tel masked]", text)
-    text = re.sub(r"(東京都|大阪府|福岡県|北海道|京都府|神奈川県|愛知県|埼玉県|千葉県|兵庫県|福岡市|横浜市)[^\n、，。 ]{0,20}", "[address masked]", text)
+    # 「@」や数字が無ければそのパターンは当たらないので、全文スキャンごと省く
+    if "@" in text:
+        text = _EMAIL_RE.sub("[email masked]", text)
+    if _DIGIT_RE.search(text):
+        text = _TEL_RE.sub("[tel masked]", text)
+    # 住所は都道府県/市名のリテラル検索（C の部分文字列検索）で当たりがあるときだけ正規表現を回す
+    if any(p in text for p in _ADDR_PREFIXES):
+        text = _ADDR_RE.sub("[address masked]", text)
     return text
 
 try:
@@ -69,10 +120,19 @@ try:
 except Exception:
     sanitize_text = _fallback_sanitize
 
+# 公開ページ用のマスク（メール・URL・@ID・郵便・電話・氏名）。sanitize.py が無ければ簡易版で代用する
+try:
+    from sanitize import sanitize_public_many, SANITIZE_VERSION  # type: ignore
+except Exception:
+    SANITIZE_VERSION = 0  # 簡易版で作ったマスク結果の印
+    def sanitize_public_many(texts):
+        return [_mask_pii(t) for t in texts]
+
 # -----------------------------
 # テンプレート読込
 # -----------------------------
-def load_index_html() -> str:
+def _read_index_html() -> Tuple[Optional[str], str]:
+    """(読み込んだパス, 本文) を返す。見つからなければパスは None"""
     candidate_paths = [
         INDEX_HTML_PATH,
         os.path.join(BASE_DIR, "templates", "index.html"),
@@ -82,15 +142,37 @@ def load_index_html() -> str:
         try:
             if p and os.path.exists(p):
                 with open(p, "r", encoding="utf-8") as f:
-                    return f.read()
+                    return p, f.read()
         except Exception:
             pass
-    return f"""<!doctype html><meta charset="utf-8"><title>議論アーカイブ MVP</title>
+    return None, f"""<!doctype html><meta charset="utf-8"><title>議論アーカイブ MVP</title>
         <h1>index.html が見つかりませんでした</h1>
         <p>探したパス: {INDEX_HTML_PATH}</p>
         <p>プロジェクト直下に <code>index.html</code> を置くか、環境変数 <code>INDEX_HTML_PATH</code> を設定してください。</p>
         """
-INDEX_HTML = load_index_html()
+
+def load_index_html() -> str:
+    return _read_index_html()[1]
+
+def _mtime_ns(path: Optional[str]) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns if path else None
+    except OSError:
+        return None
+
+# 起動時に1回だけコンパイルし、リクエストごとの字句解析/構文解析を省く
+_INDEX_PATH, _index_source = _read_index_html()
+_INDEX_MTIME = _mtime_ns(_INDEX_PATH)
+_INDEX_TPL = app.jinja_env.from_string(_index_source)
+
+def _index_template():
+    """コンパイル済みの index テンプレート。テンプレート自動リロード時（debug 等）だけ mtime を見て作り直す"""
+    global _INDEX_PATH, _INDEX_MTIME, _INDEX_TPL
+    if app.jinja_env.auto_reload and (_INDEX_PATH is None or _mtime_ns(_INDEX_PATH) != _INDEX_MTIME):
+        _INDEX_PATH, source = _read_index_html()
+        _INDEX_MTIME = _mtime_ns(_INDEX_PATH)
+        _INDEX_TPL = app.jinja_env.from_string(source)
+    return _INDEX_TPL
 
 # -----------------------------
 # DB ヘルパ
@@ -100,15 +182,74 @@ def _ensure_parent_dir(path: str):
     if parent and not os.path.exists(parent):
         os.makedirs(parent, exist_ok=True)
 
-def get_db():
-    _ensure_parent_dir(DB_PATH)  # ← フォルダがなければ作る
-    conn = sqlite3.connect(DB_PATH)
+# よく通る SQL は同じ文字列オブジェクトを使い回し、接続の文キャッシュ（cached_statements）に確実に当てる
+_SQL_SELECT_USER = "SELECT id, email, display_name, role FROM users WHERE id=?"
+_SQL_INSERT_POST = """INSERT INTO posts (thread_id, user_id, parent_post_id, content, content_html, created_at)
+                      VALUES (?, ?, ?, ?, ?, ?)"""
+_SQL_INSERT_MESSAGE = """INSERT INTO messages (thread_id, role, content, content_public, content_public_ver, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?)"""
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    # 接続ごとの設定（journal_mode=WAL は DB ファイルに残るので init_db で1回だけ）
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA busy_timeout=5000")
     return conn
 
+def _now_iso() -> str:
+    """リクエスト内で共通の現在時刻（UTC, ISO8601）。1リクエストに1回だけ整形する（リクエスト外では都度）"""
+    if not has_app_context():
+        return datetime.now(timezone.utc).isoformat()
+    now = g.get("_now_iso")
+    if now is None:
+        g._now_iso = now = datetime.now(timezone.utc).isoformat()
+    return now
+
+def _escape_html(text: str) -> str:
+    """表示用にエスケープした本文（posts.content_html に保存し、閲覧時のエスケープを省く）"""
+    return str(escape(text))
+
+def _token_hash(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+_tls = threading.local()
+
+def get_db():
+    """ワーカースレッドごとに1本の接続を持ち続ける（ページキャッシュをリクエスト間で温かいまま保つ）"""
+    db = getattr(_tls, "conn", None)
+    if db is None:
+        _tls.conn = db = _connect()
+    return db
+
+@app.teardown_appcontext
+def _end_db_request(exc):
+    # 接続は閉じない。コミットし忘れ/例外で残ったトランザクションだけ片付けて次のリクエストへ
+    db = getattr(_tls, "conn", None)
+    if db is not None and db.in_transaction:
+        if exc is None:
+            db.commit()
+        else:
+            db.rollback()
+
+def _table_columns(cur, table: str) -> set:
+    cur.execute(f"PRAGMA table_info({table})")
+    return {r["name"] for r in cur.fetchall()}
+
+_AI_UID: Optional[int] = None  # ai@local の id（init_db で確定し、以後は不変）
+
 def init_db():
-    conn = get_db()
+    _ensure_parent_dir(DB_PATH)  # ← フォルダがなければ作る（起動時に1回だけ）
+    conn = _connect()
+    # WAL: 読み取りが書き込みにブロックされないようにする
+    conn.execute("PRAGMA journal_mode=WAL")
     cur = conn.cursor()
+    # スキーマ作成〜移行〜AIユーザー作成までを1トランザクションにまとめる（コミットは最後の1回）
+    cur.execute("BEGIN")
 
     # 既存スキーマ（スレ・メッセージ）
     cur.execute("""
@@ -128,6 +269,7 @@ def init_db():
         created_at TEXT,
         FOREIGN KEY(thread_id) REFERENCES threads(id)
     )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_thread_id ON messages(thread_id, id)")
 
     # 追加: users
     cur.execute("""
@@ -140,6 +282,15 @@ def init_db():
       role TEXT DEFAULT 'user',
       created_at TEXT
     )""")
+    # メールは signup/login で .lower() した値で保存・照合する（NOCASE は ASCII しか畳まないので照合には使わない）。
+    # このインデックスは、別経路で入った大文字小文字違いの重複も DB 側で弾くためのもの
+    try:
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email COLLATE NOCASE)")
+    except sqlite3.IntegrityError:
+        # 既に重複があると作れない。黙って進めず、直すべき行があることを知らせる（照合は .lower() なので動作は続く）
+        cur.execute("SELECT COUNT(*) FROM (SELECT 1 FROM users GROUP BY email COLLATE NOCASE HAVING COUNT(*) > 1)")
+        app.logger.warning("idx_users_email を作れませんでした: 大文字小文字だけ違うメールが %d 組あります",
+                           cur.fetchone()[0])
 
     # 追加: posts
     cur.execute("""
@@ -153,8 +304,12 @@ def init_db():
       created_at TEXT,
       updated_at TEXT
     )""")
+    if "content_html" not in _table_columns(cur, "posts"):
+        cur.execute("ALTER TABLE posts ADD COLUMN content_html TEXT")  # 書き込み時にエスケープ済みの本文
     cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_thread_id ON posts(thread_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_thread_time ON posts(thread_id, created_at)")
+    # created_at で並べるクエリは無い（get_feed の UNION は一時B木でソートする）ので旧インデックスは捨てる
+    cur.execute("DROP INDEX IF EXISTS idx_posts_thread_time")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_thread_hidden_id ON posts(thread_id, is_hidden, id)")
 
     # 追加: ai_summaries
     cur.execute("""
@@ -168,6 +323,7 @@ def init_db():
       created_at TEXT
     )""")
     cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_ai_summaries_thread_hash ON ai_summaries(thread_id, hash_key)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ai_summaries_thread_id ON ai_summaries(thread_id, id DESC)")
 
     # 追加: reports
     cur.execute("""
@@ -183,51 +339,129 @@ def init_db():
       resolved_at TEXT
     )""")
 
-    # 既存threadsに列が無ければ足す（tryで安全に）
-    try:
+    # 既存threadsに列が無ければ足す（PRAGMA table_info で確認してから ALTER）
+    thread_cols = _table_columns(cur, "threads")
+    if "created_by" not in thread_cols:
         cur.execute("ALTER TABLE threads ADD COLUMN created_by INTEGER REFERENCES users(id)")
-    except sqlite3.OperationalError:
-        pass
-    try:
+    if "status" not in thread_cols:
         cur.execute("ALTER TABLE threads ADD COLUMN status TEXT DEFAULT 'open'")
-    except sqlite3.OperationalError:
-        pass
+    if "public_token_hash" not in thread_cols:
+        cur.execute("ALTER TABLE threads ADD COLUMN public_token_hash BLOB")
+    # 公開トークンはハッシュで引く（平文の前方一致で時間差が出ないように）
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_threads_public_token_hash ON threads(public_token_hash)")
+    cur.execute("SELECT id, public_token FROM threads WHERE public_token IS NOT NULL AND public_token_hash IS NULL")
+    for r in cur.fetchall():
+        cur.execute("UPDATE threads SET public_token_hash=? WHERE id=?", (_token_hash(r["public_token"]), r["id"]))
+
+    # 公開ページ用のマスク済み本文は保存時に作っておく。マスクの版が違う行（既存行・規則変更後）はここで作り直す
+    message_cols = _table_columns(cur, "messages")
+    if "content_public" not in message_cols:
+        cur.execute("ALTER TABLE messages ADD COLUMN content_public TEXT")
+    if "content_public_ver" not in message_cols:
+        cur.execute("ALTER TABLE messages ADD COLUMN content_public_ver INTEGER")
+    cur.execute("SELECT id, content FROM messages WHERE content_public_ver IS NOT ?", (SANITIZE_VERSION,))
+    stale = cur.fetchall()
+    for i in range(0, len(stale), 500):
+        chunk = stale[i:i + 500]
+        masked = sanitize_public_many([r["content"] for r in chunk])
+        cur.executemany("UPDATE messages SET content_public=?, content_public_ver=? WHERE id=?",
+                        [(m, SANITIZE_VERSION, r["id"]) for r, m in zip(chunk, masked)])
 
     # ★ AIユーザーを用意（存在すればスキップ）
-    now_iso = datetime.now(timezone.utc).isoformat()
     cur.execute("""
       INSERT OR IGNORE INTO users (email, password_hash, display_name, role, created_at)
       VALUES ('ai@local', '', 'AI', 'system', ?)
-    """, (now_iso,))
+    """, (_now_iso(),))
+    cur.execute("SELECT id FROM users WHERE email='ai@local' LIMIT 1")
+    row = cur.fetchone()
+    global _AI_UID
+    _AI_UID = int(row["id"]) if row else None
 
     conn.commit()
+    # 追加したインデックスをプランナが使えるよう統計（sqlite_stat1）を更新する。
+    # DDL しか流していない接続では PRAGMA optimize は何もしないので ANALYZE を直接呼ぶ。
+    # analysis_limit で索引ごとの走査行数を抑え、大きな DB でも起動が重くならないようにする
+    conn.execute("PRAGMA analysis_limit=400")
+    conn.execute("ANALYZE")
     conn.close()
 
-init_done = False
-
-# Ensure DB schema is initialized once per process
-@app.before_request
-def _on_boot():
-    global init_done
-    if not init_done:
+def _init_db_locked():
+    """複数ワーカーが同時に起動してもスキーマ作成が競合しないよう、ファイルロックを取って init_db する"""
+    _ensure_parent_dir(DB_PATH)
+    try:
+        import fcntl
+    except ImportError:  # Windows など
         init_db()
-        init_done = True
+        return
+    with open(DB_PATH + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            init_db()
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+# スキーマはプロセス起動時（import 時）に1回だけ用意する
+_init_db_locked()
 
 # -----------------------------
 # current_user ロード
 # -----------------------------
+USER_CACHE_TTL = 60     # 秒。ユーザー行はほぼ不変なので短時間キャッシュする
+USER_CACHE_MAX = 1024   # プロセス内キャッシュの上限件数（古いものから捨てるLRU）
+_USER_CACHE = OrderedDict()  # uid -> (有効期限, ユーザーdict)。REDIS_URL があれば Redis を使う
+_USER_CACHE_LOCK = threading.Lock()
+
+def _load_user(uid: int) -> Optional[dict]:
+    key = f"user:{uid}"
+    if _REDIS is not None:
+        try:
+            raw = _REDIS.get(key)
+            if raw:
+                return json.loads(raw)
+        except Exception:
+            pass
+    else:
+        with _USER_CACHE_LOCK:
+            hit = _USER_CACHE.get(uid)
+            if hit and hit[0] > time.monotonic():
+                _USER_CACHE.move_to_end(uid)
+                return hit[1]
+
+    row = get_db().execute(_SQL_SELECT_USER, (uid,)).fetchone()
+    user = dict(row) if row else None
+    if user is not None:
+        if _REDIS is not None:
+            try:
+                _REDIS.setex(key, USER_CACHE_TTL, json.dumps(user))
+            except Exception:
+                pass
+        else:
+            with _USER_CACHE_LOCK:
+                _USER_CACHE[uid] = (time.monotonic() + USER_CACHE_TTL, user)
+                _USER_CACHE.move_to_end(uid)
+                while len(_USER_CACHE) > USER_CACHE_MAX:
+                    _USER_CACHE.popitem(last=False)
+    return user
+
+def _forget_user(uid) -> None:
+    """ログアウトやプロフィール変更時にキャッシュを捨てる"""
+    if not uid:
+        return
+    with _USER_CACHE_LOCK:
+        _USER_CACHE.pop(uid, None)
+    if _REDIS is not None:
+        try:
+            _REDIS.delete(f"user:{uid}")
+        except Exception:
+            pass
+
 @app.before_request
 def load_current_user():
     uid = session.get("user_id")
     if not uid:
         g.current_user = None
         return
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, email, display_name, role FROM users WHERE id=?", (uid,))
-    row = cur.fetchone()
-    conn.close()
-    g.current_user = dict(row) if row else None
+    g.current_user = _load_user(uid)
 
 # -----------------------------
 # 認可デコレータ
@@ -243,9 +477,22 @@ def login_required(f):
 # -----------------------------
 # 画面: サインアップ/ログイン
 # -----------------------------
-@app.route("/signup", methods=["GET"])
-def signup_page():
-    return render_template_string("""
+# 存在しないメールでも同じコストの検証を走らせ、応答時間からユーザー有無を推測させない
+_DUMMY_PW_HASH = generate_password_hash(secrets.token_urlsafe(16), method=PW_HASH_METHOD)
+# scrypt/pbkdf2 は hashlib（OpenSSL）側で GIL を手放すので、スレッドプールで十分。
+# 上限を CPU 数に抑え、ログインが集中しても CPU と scrypt のメモリ（1回 32MB 程度）を食い潰さない
+_PW_POOL = ThreadPoolExecutor(max_workers=max(1, PW_HASH_WORKERS), thread_name_prefix="pwhash")
+
+def _hash_pw(password: str) -> str:
+    return _PW_POOL.submit(generate_password_hash, password, method=PW_HASH_METHOD).result()
+
+def _check_pw(pw_hash: str, password: str) -> bool:
+    return _PW_POOL.submit(check_password_hash, pw_hash, password).result()
+
+# 現行方式のハッシュ接頭辞（例: "scrypt:32768:8:1"）。これと違う保存値はログイン時に作り直す
+_PW_HASH_PREFIX = _DUMMY_PW_HASH.split("$", 1)[0]
+
+_SIGNUP_TPL = app.jinja_env.from_string("""
     <!doctype html><meta charset="utf-8"><title>Sign up</title>
     <h2>Sign up</h2>
     <form method="post" action="/signup">
@@ -256,6 +503,10 @@ def signup_page():
     </form>
     """)
 
+@app.route("/signup", methods=["GET"])
+def signup_page():
+    return render_template(_SIGNUP_TPL)
+
 @app.route("/signup", methods=["POST"])
 def signup():
     email = request.form.get("email","").strip().lower()
@@ -270,19 +521,15 @@ def signup():
         cur.execute("""
             INSERT INTO users (email, password_hash, display_name, created_at)
             VALUES (?, ?, ?, ?)
-        """, (email, generate_password_hash(password), display_name, datetime.now(timezone.utc).isoformat()))
+        """, (email, _hash_pw(password), display_name, _now_iso()))
         conn.commit()
         user_id = cur.lastrowid
     except sqlite3.IntegrityError:
-        conn.close()
         return "そのメールは既に登録されています", 400
-    conn.close()
     session["user_id"] = user_id
     return redirect(url_for("home"))
 
-@app.route("/login", methods=["GET"])
-def login_page():
-    return render_template_string("""
+_LOGIN_TPL = app.jinja_env.from_string("""
     <!doctype html><meta charset="utf-8"><title>Login</title>
     <h2>Login</h2>
     <form method="post" action="/login">
@@ -292,6 +539,10 @@ def login_page():
     </form>
     """)
 
+@app.route("/login", methods=["GET"])
+def login_page():
+    return render_template(_LOGIN_TPL)
+
 @app.route("/login", methods=["POST"])
 def login():
     email = request.form.get("email","").strip().lower()
@@ -300,14 +551,23 @@ def login():
     cur  = conn.cursor()
     cur.execute("SELECT id, password_hash FROM users WHERE email=?", (email,))
     row = cur.fetchone()
-    conn.close()
-    if not row or not check_password_hash(row["password_hash"], password):
+    if row is None:
+        _check_pw(_DUMMY_PW_HASH, password)
+        return "メールまたはパスワードが違います", 400
+    if not _check_pw(row["password_hash"], password):
         return "メールまたはパスワードが違います", 400
+    # 旧方式（pbkdf2 等）のハッシュは、平文が手元にあるこのタイミングで現行方式へ移行する
+    if row["password_hash"].split("$", 1)[0] != _PW_HASH_PREFIX:
+        cur.execute("UPDATE users SET password_hash=? WHERE id=?",
+                    (_hash_pw(password), row["id"]))
+        conn.commit()
+    _forget_user(row["id"])  # ログインし直したら最新の行を読み直す
     session["user_id"] = row["id"]
     return redirect(url_for("home"))
 
 @app.route("/logout", methods=["POST"])
 def logout():
+    _forget_user(session.get("user_id"))
     session.clear()
     return redirect(url_for("home"))
 
@@ -322,37 +582,21 @@ def create_thread_route():
     if not title or not body:
         return "title と body は必須です", 400
 
+    now_iso = _now_iso()
     conn = get_db()
     cur  = conn.cursor()
-    cur.execute("INSERT INTO threads (title, created_by, is_public, status, created_at) VALUES (?, ?, 1, 'open', ?)",
-                (title, g.current_user["id"], datetime.now(timezone.utc).isoformat()))
-    thread_id = cur.lastrowid
-    cur.execute("""INSERT INTO posts (thread_id, user_id, parent_post_id, content, created_at)
-                   VALUES (?, ?, NULL, ?, ?)""",
-                (thread_id, g.current_user["id"], body, datetime.now(timezone.utc).isoformat()))
-    conn.commit()
-    conn.close()
+    # スレッドと最初の投稿は1トランザクション（コミット＝fsync は1回）
+    with conn:
+        cur.execute("INSERT INTO threads (title, created_by, is_public, status, created_at) VALUES (?, ?, 1, 'open', ?)",
+                    (title, g.current_user["id"], now_iso))
+        thread_id = cur.lastrowid
+        cur.execute(_SQL_INSERT_POST,
+                    (thread_id, g.current_user["id"], None, body, _escape_html(body), now_iso))
+    _invalidate_threads_cache()
     # トップページに統一
     return redirect(url_for("home", thread_id=thread_id))
 
-@app.route("/threads/<int:thread_id>", methods=["GET"])
-def view_thread(thread_id: int):
-    conn = get_db()
-    cur  = conn.cursor()
-    cur.execute("SELECT t.*, u.display_name AS author_name FROM threads t LEFT JOIN users u ON u.id=t.created_by WHERE t.id=?", (thread_id,))
-    th = cur.fetchone()
-    if not th:
-        conn.close()
-        return "thread not found", 404
-
-    cur.execute("SELECT p.*, u.display_name AS user_name FROM posts p LEFT JOIN users u ON u.id=p.user_id WHERE p.thread_id=? AND p.is_hidden=0 ORDER BY p.id ASC", (thread_id,))
-    posts = cur.fetchall()
-
-    cur.execute("SELECT content, created_at FROM ai_summaries WHERE thread_id=? ORDER BY id DESC LIMIT 1", (thread_id,))
-    summary = cur.fetchone()
-    conn.close()
-
-    return render_template_string("""
+_THREAD_VIEW_TPL = app.jinja_env.from_string("""
     <!doctype html><meta charset="utf-8"><title>{{ th.title }}</title>
     <h2>{{ th.title }}</h2>
     <div>by {{ th.author_name or 'unknown' }} / {{ th.created_at }}</div>
@@ -366,7 +610,8 @@ def view_thread(thread_id: int):
     {% for p in posts %}
       <div style="border:1px solid #ddd;margin:8px 0;padding:8px;border-radius:8px;">
         <div style="color:#666;font-size:12px;">{{ p.user_name or '匿名' }} / {{ p.created_at }}</div>
-        <div style="white-space:pre-wrap">{{ p.content }}</div>
+        {# content_html は書き込み時にエスケープ済み。列追加前の投稿は従来どおり描画時にエスケープ #}
+        <div style="white-space:pre-wrap">{% if p.content_html is not none %}{{ p.content_html|safe }}{% else %}{{ p.content }}{% endif %}</div>
       </div>
     {% endfor %}
 
@@ -383,7 +628,23 @@ def view_thread(thread_id: int):
     {% else %}
       <div><a href="/login">ログイン</a>すると返信できます</div>
     {% endif %}
-    """, th=th, posts=posts, summary=summary)
+    """)
+
+@app.route("/threads/<int:thread_id>", methods=["GET"])
+def view_thread(thread_id: int):
+    # 同じ接続で3本のSELECTを流す（文はステートメントキャッシュに載る）
+    conn = get_db()
+    th = conn.execute("SELECT t.*, u.display_name AS author_name FROM threads t LEFT JOIN users u ON u.id=t.created_by WHERE t.id=?", (thread_id,)).fetchone()
+    if not th:
+        return "thread not found", 404
+
+    # idx_posts_thread_hidden_id で範囲スキャン
+    posts = conn.execute("SELECT p.*, u.display_name AS user_name FROM posts p LEFT JOIN users u ON u.id=p.user_id WHERE p.thread_id=? AND p.is_hidden=0 ORDER BY p.id ASC", (thread_id,)).fetchall()
+
+    # idx_ai_summaries_thread_id の先頭1件だけを読む
+    summary = conn.execute("SELECT content, created_at FROM ai_summaries WHERE thread_id=? ORDER BY id DESC LIMIT 1", (thread_id,)).fetchone()
+
+    return render_template(_THREAD_VIEW_TPL, th=th, posts=posts, summary=summary)
 
 @app.route("/threads/<int:thread_id>/posts", methods=["POST"])
 @login_required
@@ -399,14 +660,16 @@ def add_post(thread_id: int):
     cur.execute("SELECT id, status FROM threads WHERE id=?", (thread_id,))
     th = cur.fetchone()
     if not th or th["status"] == "locked":
-        conn.close()
         return "投稿できません（存在しない/ロック中）", 400
-
-    cur.execute("""INSERT INTO posts (thread_id, user_id, parent_post_id, content, created_at)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (thread_id, g.current_user["id"], parent_id, content, datetime.now(timezone.utc).isoformat()))
+    # 返信先はフォームの値そのままなので、同じスレッドに実在する投稿のときだけ使う（外部キー違反で 500 にしない）
+    if parent_id is not None:
+        cur.execute("SELECT 1 FROM posts WHERE id=? AND thread_id=?", (parent_id, thread_id))
+        if cur.fetchone() is None:
+            parent_id = None
+
+    cur.execute(_SQL_INSERT_POST,
+                (thread_id, g.current_user["id"], parent_id, content, _escape_html(content), _now_iso()))
     conn.commit()
-    conn.close()
     # トップページに統一
     return redirect(url_for("home", thread_id=thread_id))
 
@@ -418,9 +681,8 @@ def report_post(post_id: int):
     cur  = conn.cursor()
     cur.execute("""INSERT INTO reports (target_type, target_id, reported_by, reason, status, created_at)
                    VALUES ('post', ?, ?, ?, 'open', ?)""",
-                (post_id, g.current_user["id"], reason, datetime.now(timezone.utc).isoformat()))
+                (post_id, g.current_user["id"], reason, _now_iso()))
     conn.commit()
-    conn.close()
     return "reported", 200
 
 # -----------------------------
@@ -430,31 +692,28 @@ def report_post(post_id: int):
 # --- 公開ビュー（読み取り専用） ---
 @app.route("/p/<token>", methods=["GET"])
 def public_view(token: str):
-    conn = get_db()
-    cur = conn.cursor()
-
-    # 公開中スレッドを取得
-    cur.execute("SELECT id, title, created_at FROM threads WHERE public_token=? AND is_public=1", (token,))
-    th = cur.fetchone()
+    # 公開中スレッドと messages（AI＋ユーザーの分析用発言）を時系列で取得
+    th, msgs = get_public_thread_by_token(token)
     if not th:
-        conn.close()
         return "not found", 404
 
     thread_id = th["id"]
-
-    # 公開ビューでは messages（AI＋ユーザーの分析用発言）を時系列で見せる
-    cur.execute("SELECT role, content, created_at FROM messages WHERE thread_id=? ORDER BY id ASC", (thread_id,))
-    msgs = cur.fetchall()
-    conn.close()
-
-    # 既存の INDEX_HTML を流用して表示だけ
-    return render_template_string(
-        INDEX_HTML,
+    # 公開ページには保存時にマスク済みの本文を出す。版が古い行（別プロセスが書いた等）だけまとめて作り直す
+    masked = [m["content_public"] if m["content_public_ver"] == SANITIZE_VERSION else None for m in msgs]
+    stale = [i for i, c in enumerate(masked) if c is None]
+    if stale:
+        for i, c in zip(stale, sanitize_public_many([msgs[i]["content"] for i in stale])):
+            masked[i] = c
+    history = [{"role": m["role"], "content": c, "created_at": m["created_at"]} for m, c in zip(msgs, masked)]
+
+    # 既存の index テンプレートを流用して表示だけ
+    return render_template(
+        _index_template(),
         article="",
         result=None,
         threads=list_threads(),       # 右のスレッド一覧はそのまま
         active_thread_id=thread_id,   # ヘッダに #ID 表示
-        history=[{"role": m["role"], "content": m["content"], "created_at": m["created_at"]} for m in msgs],
+        history=history,
         share_url=request.url,        # 共有URLは表示
         is_public_view=True           # ← 追加：公開ビュー（操作系は隠す）
     )
@@ -501,6 +760,23 @@ def _build_thread_prompt_for_summary(article_text: str, recent_posts_text: str,
         "\n----\n出力は本文のみ。前置き・見出しは不要。\n"
     )
 
+# HTTP/2 は h2 が入っているときだけ有効にする
+try:
+    import h2  # type: ignore  # noqa: F401
+    _OPENAI_HTTP2 = True
+except ImportError:
+    _OPENAI_HTTP2 = False
+
+# プロセスで1つのクライアントを共有し、TCP/TLS 接続をリクエスト間で使い回す
+# 認証ヘッダもクライアント側に持たせ、リトライ時は本文を送り直すだけにする
+_OPENAI_HTTP = httpx.Client(
+    base_url="https://api.openai.com",
+    http2=_OPENAI_HTTP2,
+    headers={"Authorization": f"Bearer {OPENAI_API_KEY}"} if OPENAI_API_KEY else None,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=60.0),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+)
+
 def call_openai_with_prompt(
     prompt: str,
     *,
@@ -530,27 +806,26 @@ def call_openai_with_prompt(
     last_err = "unknown error"
     for attempt in range(1, retries + 1):
         try:
-            with httpx.Client(timeout=timeout_sec) as client:
-                resp = client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers={"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"},
-                    json=payload,
-                )
-                if resp.status_code >= 400:
-                    last_err = f"HTTP {resp.status_code}: {resp.text[:500]}"
-                    if resp.status_code in (429, 500, 502, 503, 504) and attempt < retries:
-                        time.sleep(1.2 * attempt)
-                        continue
-                    return False, f"⚠️ APIエラー: {last_err}"
-                data = resp.json()
-                text = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
-                if text and text.strip():
-                    return True, text.strip()
-                payload["messages"].append({"role": "user", "content": "前の回答が空でした。必ずテキストで返してください。"})
-                if attempt < retries:
-                    time.sleep(0.8 * attempt)
+            resp = _OPENAI_HTTP.post(
+                "/v1/chat/completions",
+                json=payload,
+                timeout=httpx.Timeout(timeout_sec, connect=5.0),
+            )
+            if resp.status_code >= 400:
+                last_err = f"HTTP {resp.status_code}: {resp.text[:500]}"
+                if resp.status_code in (429, 500, 502, 503, 504) and attempt < retries:
+                    time.sleep(1.2 * attempt)
                     continue
-                return False, "⚠️ 応答が空でした。"
+                return False, f"⚠️ APIエラー: {last_err}"
+            data = resp.json()
+            text = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
+            if text and text.strip():
+                return True, text.strip()
+            payload["messages"].append({"role": "user", "content": "前の回答が空でした。必ずテキストで返してください。"})
+            if attempt < retries:
+                time.sleep(0.8 * attempt)
+                continue
+            return False, "⚠️ 応答が空でした。"
         except Exception as e:
             last_err = str(e)
             if attempt < retries:
@@ -560,13 +835,8 @@ def call_openai_with_prompt(
     return False, f"⚠️ 失敗しました: {last_err}"
 
 def _get_ai_user_id() -> Optional[int]:
-    """AIユーザー（ai@local）のIDを取得"""
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE email='ai@local' LIMIT 1")
-    row = cur.fetchone()
-    conn.close()
-    return int(row["id"]) if row else None
+    """AIユーザー（ai@local）のIDを取得（起動時の init_db で読んだ値を返すだけ）"""
+    return _AI_UID
 
 @app.route("/threads/<int:thread_id>/summarize", methods=["POST"])
 @login_required
@@ -576,81 +846,76 @@ def summarize_thread(thread_id: int):
     conn = get_db()
     cur  = conn.cursor()
 
-    # 記事＝最初のpost
-    cur.execute("SELECT id, content FROM posts WHERE thread_id=? ORDER BY id ASC LIMIT 1", (thread_id,))
-    first = cur.fetchone()
-    if not first:
-        conn.close()
+    # 最新投稿ID（キャッシュキーの材料。本文はキャッシュ未ヒット時だけ読む）
+    cur.execute("SELECT id FROM posts WHERE thread_id=? ORDER BY id DESC LIMIT 1", (thread_id,))
+    latest = cur.fetchone()
+    if not latest:
         return "記事がありません", 400
-    article_text = first["content"]
-
-    # 直近N件（新しい順）
-    cur.execute("SELECT id, content FROM posts WHERE thread_id=? ORDER BY id DESC LIMIT ?", (thread_id, N_RECENT))
-    recent = cur.fetchall()
-    if not recent:
-        conn.close()
-        return "投稿がありません", 400
-
-    latest_post_id = recent[0]["id"]
-    recent_text = "\n\n".join([f"- {r['content']}" for r in recent])
-
-    # 直近のAI文（表現の焼き直しを避けるためプロンプトへ渡す）
-    cur.execute("SELECT content FROM ai_summaries WHERE thread_id=? ORDER BY id DESC LIMIT 1", (thread_id,))
-    last_ai_row = cur.fetchone()
-    last_ai_text = last_ai_row["content"] if last_ai_row else ""
-
-    # スタイルヒント（スレッド×最新投稿でローテーション）
-    style_hint = _style_hint_for_thread(thread_id, latest_post_id)
+    latest_post_id = latest["id"]
 
     # キャッシュキー
     mode  = "conversation"
     model = OPENAI_MODEL
-    # 投稿テキストの指先だけでも差分を拾えるよう recent_text のハッシュを含める
-    recent_digest = hashlib.sha256(recent_text.encode("utf-8")).hexdigest()[:16]
-    raw_for_hash = f"{article_text}\n#last={latest_post_id}\n#recent={recent_digest}\n#style={style_hint}\n#mode={mode}\n#model={model}"
-    hash_key = hashlib.sha256(raw_for_hash.encode("utf-8")).hexdigest()
+    # 記事（最初のpost）・直近投稿・スタイルヒントは thread_id と最新投稿IDで決まるので、それだけをキーにする
+    raw_for_hash = f"#thread={thread_id}#last={latest_post_id}#mode={mode}#model={model}"
+    hash_key = hashlib.blake2b(raw_for_hash.encode("utf-8"), digest_size=32).hexdigest()
 
     # 既存キャッシュ確認
+    ai_uid = _get_ai_user_id()
     cur.execute("SELECT content FROM ai_summaries WHERE thread_id=? AND hash_key=? LIMIT 1", (thread_id, hash_key))
     hit = cur.fetchone()
-    ai_uid = _get_ai_user_id()
 
     if hit:
-        # ★ キャッシュの内容も投稿として積む（2回目以降もタイムラインに追加）
-        cur.execute("""INSERT INTO posts (thread_id, user_id, parent_post_id, content, created_at)
-                       VALUES (?, ?, NULL, ?, ?)""",
-                    (thread_id, ai_uid, f"【AIの整理】\n{hit['content']}", datetime.now(timezone.utc).isoformat()))
-        conn.commit()
-    conn.close()
+        ai_text = hit["content"]
+    else:
+        # 生成（← ここはキャッシュ未ヒット時だけ通る）
+        ok, text = _generate_thread_reply(cur, thread_id, latest_post_id, N_RECENT)
+        if not ok or not text.strip():
+            return f"AI生成に失敗しました: {text}", 500
+        ai_text = text.strip()
+
+    # 保存：未ヒット時はキャッシュ＋投稿、ヒット時も投稿として積む（2回目以降もタイムラインに追加）。コミットは1回
+    ai_post = f"【AIの整理】\n{ai_text}"
+    now_iso = _now_iso()
+    with conn:
+        if not hit:
+            # 同時クリックで先に保存された場合は UNIQUE(thread_id, hash_key) で弾かれるだけにする
+            cur.execute("""INSERT OR IGNORE INTO ai_summaries (thread_id, model, mode, content, hash_key, created_at)
+                           VALUES (?, ?, ?, ?, ?, ?)""",
+                        (thread_id, model, mode, ai_text, hash_key, now_iso))
+        cur.execute(_SQL_INSERT_POST,
+                    (thread_id, ai_uid, None, ai_post, _escape_html(ai_post), now_iso))
     # トップページに統一
     return redirect(url_for("home", thread_id=thread_id))
 
-    # 生成（← ここはキャッシュ未ヒット時だけ通る）
+def _generate_thread_reply(cur, thread_id: int, latest_post_id: int, n_recent: int) -> Tuple[bool, str]:
+    """キャッシュ未ヒット時だけ、記事・直近投稿・直近AI文を読んでプロンプトを組み、生成する"""
+    # 記事＝最初のpost
+    cur.execute("SELECT id, content FROM posts WHERE thread_id=? ORDER BY id ASC LIMIT 1", (thread_id,))
+    article_text = cur.fetchone()["content"]
+
+    # 直近N件（新しい順）
+    cur.execute("SELECT id, content FROM posts WHERE thread_id=? ORDER BY id DESC LIMIT ?", (thread_id, n_recent))
+    recent = cur.fetchall()
+    recent_text = "\n\n".join(f"- {r['content']}" for r in recent)
+
+    # 直近のAI文（表現の焼き直しを避けるためプロンプトへ渡す）
+    cur.execute("SELECT content FROM ai_summaries WHERE thread_id=? ORDER BY id DESC LIMIT 1", (thread_id,))
+    last_ai_row = cur.fetchone()
+    last_ai_text = last_ai_row["content"] if last_ai_row else ""
+
+    # スタイルヒント（スレッド×最新投稿でローテーション）
+    style_hint = _style_hint_for_thread(thread_id, latest_post_id)
+
     prompt = _build_thread_prompt_for_summary(article_text, recent_text, style_hint, last_ai_text)
     # 会話寄せなので温度やペナルティを少し上げてバリエーションを出す
-    ok, text = call_openai_with_prompt(
+    return call_openai_with_prompt(
         prompt,
         temperature=0.7,
         presence_penalty=0.5,
         frequency_penalty=0.2,
         max_tokens=700
     )
-    if not ok or not text.strip():
-        conn.close()
-        return f"AI生成に失敗しました: {text}", 500
-    ai_text = text.strip()
-
-    # 保存（キャッシュ）＋ 投稿
-    cur.execute("""INSERT INTO ai_summaries (thread_id, model, mode, content, hash_key, created_at)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (thread_id, model, mode, ai_text, hash_key, datetime.now(timezone.utc).isoformat()))
-    cur.execute("""INSERT INTO posts (thread_id, user_id, parent_post_id, content, created_at)
-                   VALUES (?, ?, NULL, ?, ?)""",
-                (thread_id, ai_uid, f"【AIの整理】\n{ai_text}", datetime.now(timezone.utc).isoformat()))
-    conn.commit()
-    conn.close()
-    # トップページに統一
-    return redirect(url_for("home", thread_id=thread_id))
 
 # -----------------------------
 # スレッド/メッセージ操作（既存UI用）
@@ -660,11 +925,11 @@ def create_thread(title: Optional[str]) -> int:
     cur = conn.cursor()
     cur.execute(
         "INSERT INTO threads (title, created_at) VALUES (?, ?)",
-        (title or "無題スレッド", datetime.now(timezone.utc).isoformat())
+        (title or "無題スレッド", _now_iso())
     )
     conn.commit()
+    _invalidate_threads_cache()
     tid = cur.lastrowid
-    conn.close()
     return tid
 
 def get_thread(thread_id: int):
@@ -672,26 +937,58 @@ def get_thread(thread_id: int):
     cur = conn.cursor()
     cur.execute("SELECT * FROM threads WHERE id = ?", (thread_id,))
     row = cur.fetchone()
-    conn.close()
     return row
 
-def list_threads():
+THREADS_PAGE_SIZE = 100
+THREADS_MAX_PAGE = 10_000  # ?page= の上限（SQLite の整数に収まらない値で OFFSET が溢れないように）
+THREADS_CACHE_TTL = 5.0  # 秒。別ワーカーでの作成/公開切替が見えるまでの上限
+# 1ページ目だけプロセス内にキャッシュ。自プロセスでの書き込みは ver を進めて即無効化する
+_THREADS_CACHE = {"ver": 0, "rows": None, "rows_ver": -1, "at": 0.0}
+
+def _invalidate_threads_cache():
+    _THREADS_CACHE["ver"] += 1
+    _THREADS_CACHE["rows"] = None
+
+def list_threads(page: int = 0):
+    """サイドバー用のスレッド一覧（テンプレートが使う列だけ・1ページ分）"""
+    page = max(page, 0)
+    cache = _THREADS_CACHE
+    ver = cache["ver"]
+    if page == 0 and cache["rows"] is not None and cache["rows_ver"] == ver \
+            and time.monotonic() - cache["at"] <= THREADS_CACHE_TTL:
+        return cache["rows"]
+
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM threads ORDER BY id DESC")
+    cur.execute(
+        "SELECT id, title, is_public, public_token, created_at FROM threads ORDER BY id DESC LIMIT ? OFFSET ?",
+        (THREADS_PAGE_SIZE, page * THREADS_PAGE_SIZE)
+    )
     rows = cur.fetchall()
-    conn.close()
+    # 読んでいる間に無効化されていたら古い結果は載せない
+    if page == 0 and cache["ver"] == ver:
+        cache.update(rows=rows, rows_ver=ver, at=time.monotonic())
     return rows
 
 def add_message(thread_id: int, role: str, content: str):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO messages (thread_id, role, content, created_at) VALUES (?, ?, ?, ?)",
-        (thread_id, role, content, datetime.now(timezone.utc).isoformat())
-    )
+    public = sanitize_public_many([content])[0]
+    cur.execute(_SQL_INSERT_MESSAGE, (thread_id, role, content, public, SANITIZE_VERSION, _now_iso()))
     conn.commit()
-    conn.close()
+
+def add_messages(thread_id: int, items):
+    """(role, content) の組をまとめて1トランザクションで保存する"""
+    items = list(items)
+    now_iso = _now_iso()
+    publics = sanitize_public_many([content for _, content in items])
+    conn = get_db()
+    with conn:
+        conn.executemany(
+            _SQL_INSERT_MESSAGE,
+            [(thread_id, role, content, public, SANITIZE_VERSION, now_iso)
+             for (role, content), public in zip(items, publics)]
+        )
 
 def get_history(thread_id: int):
     conn = get_db()
@@ -700,9 +997,8 @@ def get_history(thread_id: int):
         "SELECT role, content, created_at FROM messages WHERE thread_id = ? ORDER BY id ASC",
         (thread_id,)
     )
-    rows = cur.fetchall()
-    conn.close()
-    return [{"role": r["role"], "content": r["content"], "created_at": r["created_at"]} for r in rows]
+    # sqlite3.Row は m.role / m["role"] どちらでも読めるので dict に詰め直さない
+    return cur.fetchall()
 
 def set_publish(thread_id: int, make_public: bool) -> Tuple[bool, Optional[str]]:
     conn = get_db()
@@ -711,52 +1007,87 @@ def set_publish(thread_id: int, make_public: bool) -> Tuple[bool, Optional[str]]
         cur.execute("SELECT public_token FROM threads WHERE id = ?", (thread_id,))
         row = cur.fetchone()
         token = row["public_token"] if row and row["public_token"] else secrets.token_urlsafe(18)
-        cur.execute("UPDATE threads SET is_public=1, public_token=? WHERE id=?", (token, thread_id))
+        cur.execute("UPDATE threads SET is_public=1, public_token=?, public_token_hash=? WHERE id=?",
+                    (token, _token_hash(token), thread_id))
         conn.commit()
-        conn.close()
+        _invalidate_threads_cache()
         share_url = f"{PUBLIC_BASE_URL.rstrip('/')}/p/{token}" if PUBLIC_BASE_URL else url_for("public_view", token=token, _external=True)
         return True, share_url
     else:
         cur.execute("UPDATE threads SET is_public=0 WHERE id=?", (thread_id,))
         conn.commit()
-        conn.close()
+        _invalidate_threads_cache()
         return False, None
 
 def get_public_thread_by_token(token: str):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT id, title, created_at FROM threads WHERE public_token=? AND is_public=1", (token,))
+    # ハッシュのインデックスで引き、最後に平文トークンを定数時間で照合する
+    cur.execute("SELECT id, title, created_at, public_token FROM threads WHERE public_token_hash=? AND is_public=1",
+                (_token_hash(token),))
     row = cur.fetchone()
-    if not row:
-        conn.close()
+    if not row or not hmac.compare_digest(row["public_token"].encode("utf-8"), token.encode("utf-8")):
         return None, None
     thread_id = row["id"]
-    cur.execute("SELECT role, content, created_at FROM messages WHERE thread_id=? ORDER BY id ASC", (thread_id,))
+    cur.execute("""SELECT role, content, content_public, content_public_ver, created_at
+                   FROM messages WHERE thread_id=? ORDER BY id ASC""", (thread_id,))
     msgs = cur.fetchall()
-    conn.close()
     return row, msgs
 
-def get_posts_for_feed(thread_id: int):
-    """タイムライン用に posts を取得（表示専用・必要最低限）。"""
+def get_feed(thread_id: int):
+    """タイムライン用に messages と posts を1本のクエリでマージして取得（表示専用・必要最低限）。"""
     conn = get_db()
     cur = conn.cursor()
+    # posts は history と同じ形に揃える（roleは user で表示）。
+    # created_at が同じときは messages → posts、その中は id 順（従来の Python 側ソートと同じ並び）
     cur.execute(
-        "SELECT content, created_at FROM posts WHERE thread_id = ? AND is_hidden = 0 ORDER BY id ASC",
-        (thread_id,)
+        """SELECT role, content, created_at FROM (
+             SELECT 0 AS src, id, role, content, created_at FROM messages WHERE thread_id = ?
+             UNION ALL
+             SELECT 1 AS src, id, 'user' AS role, content, created_at FROM posts WHERE thread_id = ? AND is_hidden = 0
+           ) ORDER BY created_at ASC, src ASC, id ASC""",
+        (thread_id, thread_id)
     )
-    rows = cur.fetchall()
-    conn.close()
-    # history と同じ形に揃える（roleは user で表示）
-    return [{"role": "user", "content": r["content"], "created_at": r["created_at"]} for r in rows]
+    return cur.fetchall()
 
 
 
 # -----------------------------
 # ルーティング
 # -----------------------------
+COLD_INDEX_TTL = 5.0  # 秒
+_COLD_INDEX = {"at": 0.0, "ver": -1, "html": None}
+
+def _cold_index_response():
+    """未ログイン・クエリ無しのトップは誰に対しても同じ内容なので、描画結果を短時間使い回す"""
+    now = time.monotonic()
+    ver = _THREADS_CACHE["ver"]
+    if _COLD_INDEX["html"] is None or _COLD_INDEX["ver"] != ver or now - _COLD_INDEX["at"] > COLD_INDEX_TTL:
+        _COLD_INDEX["html"] = render_template(
+            _index_template(),
+            article="",
+            result=None,
+            threads=list_threads(),
+            active_thread_id=None,
+            history=[],
+            share_url=None,
+            is_public_view=False
+        )
+        _COLD_INDEX["at"] = now
+        _COLD_INDEX["ver"] = ver
+    resp = app.response_class(_COLD_INDEX["html"], mimetype="text/html")
+    resp.headers["Cache-Control"] = "private, max-age=5"
+    return resp
+
 @app.route("/", methods=["GET"])
 def home():
+    if not request.args and not g.current_user:
+        return _cold_index_response()
+
     thread_id = request.args.get("thread_id", "").strip()
+    page = request.args.get("page", "").strip()
+    # 一覧のページ送りリンクは無く、?page= は URL を直接打ったときだけ来る。ASCII の数字だけ受け、上限で丸める
+    page = min(int(page), THREADS_MAX_PAGE) if (page.isascii() and page.isdigit()) else 0
     active_thread_id = None
     history = []  # messages + posts をマージして流す
     share_url = None
@@ -768,21 +1099,16 @@ def home():
             if th["is_public"]:
                 token = th["public_token"]
                 share_url = f"{PUBLIC_BASE_URL.rstrip('/')}/p/{token}" if PUBLIC_BASE_URL else url_for("public_view", token=token, _external=True)
-            # messages と posts をマージして、created_at 昇順に並べ替え
-            msgs  = get_history(active_thread_id)
-            posts = get_posts_for_feed(active_thread_id)
-            merged = msgs + posts
-            # ISO8601(UTC)文字列なので文字列ソートでも概ね安全だが、念のためキーを明示
-            merged.sort(key=lambda x: x.get("created_at", ""))
-            history = merged
+            # messages と posts を SQLite 側でマージして、created_at 昇順に並べる
+            history = get_feed(active_thread_id)
         else:
             active_thread_id = None
 
-    return render_template_string(
-        INDEX_HTML,
+    return render_template(
+        _index_template(),
         article="",
         result=None,
-        threads=list_threads(),
+        threads=list_threads(page),
         active_thread_id=active_thread_id,
         history=history,
         share_url=share_url,
@@ -808,12 +1134,12 @@ def analyze():
         thread_id = create_thread(thread_title)
 
     user_blob = f"【記事】\n{article}\n\n【コメント】\n{comment}"
-    add_message(thread_id, "user", user_blob)
 
     ok, text = call_openai_with_prompt(build_conversation_prompt(article, comment))
 
+    # ユーザー発言と応答は1回のコミットで保存
     role = "assistant" if ok else "system"
-    add_message(thread_id, role, text)
+    add_messages(thread_id, [("user", user_blob), (role, text)])
 
     th = get_thread(thread_id)
     share_url = None
@@ -833,22 +1159,7 @@ def publish(thread_id: int):
     is_public, share_url = set_publish(thread_id, new_val)
     return jsonify({"ok": True, "is_public": is_public, "share_url": share_url})
 
-@app.route("/threads", methods=["GET"])
-def list_threads_route():
-    conn = get_db()
-    cur  = conn.cursor()
-    cur.execute("""
-      SELECT t.id, t.title, t.created_at, t.is_public, t.status,
-             u.display_name AS author_name
-      FROM threads t
-      LEFT JOIN users u ON u.id = t.created_by
-      WHERE t.status != 'hidden'
-      ORDER BY t.id DESC
-    """)
-    rows = cur.fetchall()
-    conn.close()
-
-    return render_template_string("""
+_THREAD_LIST_TPL = app.jinja_env.from_string("""
     <!doctype html><meta charset="utf-8"><title>Threads</title>
     <h2 style="margin:12px 0">スレッド一覧</h2>
 
@@ -875,7 +1186,23 @@ def list_threads_route():
         <li style="color:#666;">スレッドはまだありません。</li>
       {% endif %}
     </ul>
-    """, rows=rows)
+    """)
+
+@app.route("/threads", methods=["GET"])
+def list_threads_route():
+    conn = get_db()
+    cur  = conn.cursor()
+    cur.execute("""
+      SELECT t.id, t.title, t.created_at, t.is_public, t.status,
+             u.display_name AS author_name
+      FROM threads t
+      LEFT JOIN users u ON u.id = t.created_by
+      WHERE t.status != 'hidden'
+      ORDER BY t.id DESC
+    """)
+    rows = cur.fetchall()
+
+    return render_template(_THREAD_LIST_TPL, rows=rows)
 
 # -----------------------------
 # エントリポイント
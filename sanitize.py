@@ -1,30 +1,134 @@
+import functools
 import re
 
-EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b')
-PHONE_RE = re.compile(r'\b(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{2,4}\)?[-.\s]?)?\d{3,4}[-.\s]?\d{3,4}\b')
+# 境界は \b ではなく「英数字（全角数字を含む）に隣接しない」で書く。\b だと漢字・かなも単語文字なので、
+# 「電話は03-1234-5678です」のように日本語に続く番号やアドレスが境界にならず素通りする
+_NB = r'(?<![A-Za-z_\d])'
+_NA = r'(?![A-Za-z_\d])'
+
+EMAIL_RE = re.compile(rf'{_NB}[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{{2,}}{_NA}')
+PHONE_RE = re.compile(rf'{_NB}(?:\+?\d{{1,3}}[-.\s]?)?(?:\(?\d{{2,4}}\)?[-.\s]?)?\d{{3,4}}[-.\s]?\d{{3,4}}{_NA}')
 ADDRESS_HINT_RE = re.compile(r'(丁目|番地|号|区|市|町|村|都|道|府|県)')
 NAME_HINT_RE = re.compile(r'(さん|氏|様|くん|ちゃん)')
+URL_RE = re.compile(r"https?://[A-Za-z0-9\-._~:/?#\[\]@!$&'()*+,;=%]+")
+HANDLE_RE = re.compile(r'@[A-Za-z0-9_]{2,15}')
+# 後ろに「-」や数字が続くものは電話番号（090-1234-5678 の頭）なので郵便にしない
+POSTAL_RE = re.compile(rf'(?:〒|{_NB})\d{{3}}-\d{{4}}(?![-A-Za-z_\d])')
+
+# パターンやラベルを変えたら上げる（DB に保存済みのマスク結果を起動時に作り直す）
+SANITIZE_VERSION = 4
+
+MASK_EMAIL = '［メール］'
+MASK_URL = '［URL］'
+MASK_HANDLE = '［ハンドル］'
+MASK_POSTAL = '［郵便］'
+MASK_PHONE = '［電話］'
+MASK_NAME = '［氏名］'
+
+# 並びは従来の sub の順（先に当たったものが優先されるのも同じ）。
+# メール/ハンドルは「@」、URL は「://」が本文に無ければ当たらないので、その枝を外した版も作れるようにする
+def _master_src(phone: str, at: bool = True, url: bool = True) -> str:
+    parts = []
+    # 各枝の1文字目になり得る文字。先頭の先読みにしておくと、境界の後読みから始まる枝があっても
+    # sre が文字クラスで開始位置を読み飛ばせる（無いと全位置で照合を試す）
+    first = r'〒\d+('
+    if at:
+        parts.append(f'(?P<email>{EMAIL_RE.pattern})')
+        first += r'A-Za-z0-9._%\-@'
+    if url:
+        parts.append(f'(?P<url>{URL_RE.pattern})')
+        first += 'h'
+    if at:
+        parts.append(f'(?P<handle>{HANDLE_RE.pattern})')
+    parts.append(f'(?P<postal>{POSTAL_RE.pattern})')
+    parts.append(f'(?P<phone>{phone})')
+    return f'(?=[{first}])(?:' + '|'.join(parts) + ')'
+
+# PHONE_RE と同じ一致。区切り文字・「+」・「)」は、取れるのに手放しても後続の \d や「(」には当たらないので
+# 独占的量指定（Python 3.11+）にしてバックトラックの分岐から外す。数字の桁数の揺れは従来どおり
+_PHONE_POSSESSIVE = rf'{_NB}(?:\+?+\d{{1,3}}[-.\s]?+)?(?:\(?+\d{{2,4}}\)?+[-.\s]?+)?\d{{3,4}}[-.\s]?+\d{{3,4}}{_NA}'
+
+def _phone_src() -> str:
+    try:
+        re.compile(_PHONE_POSSESSIVE)
+    except re.error:  # 3.10 以前は独占的量指定が無い
+        return PHONE_RE.pattern
+    return _PHONE_POSSESSIVE
+
+_LABELS = {
+    'email': MASK_EMAIL,
+    'url': MASK_URL,
+    'handle': MASK_HANDLE,
+    'postal': MASK_POSTAL,
+    'phone': MASK_PHONE,
+}
+
+def _repl(m) -> str:
+    return _LABELS[m.lastgroup]
+
+_phone = _phone_src()
+# ('@' を含むか, '://' を含むか) -> 当たり得る枝だけのパターン
+_MASTERS = {(at, url): re.compile(_master_src(_phone, at, url))
+            for at in (False, True) for url in (False, True)}
+_MASTER_RE = _MASTERS[True, True]
+
+# ASCII だけの本文は bytes の正規表現で回す（1バイト幅のループになる分速い）。
+# 日本語を含む本文は UTF-8 にすると3倍に膨らみ、かえって遅くなるので str のまま
+_MASTERS_B = {k: re.compile(p.pattern.encode('utf-8')) for k, p in _MASTERS.items()}
+_LABELS_B = {k: v.encode('utf-8') for k, v in _LABELS.items()}
 
-def _mask(label: str) -> str:
-    return f'［{label}］'
+def _repl_b(m) -> bytes:
+    return _LABELS_B[m.lastgroup]
+
+# 敬称の直前最大4文字を伏せる。最短一致なので、直前の敬称の終わりより手前には戻らない。
+# 改行も数える。\x1e（まとめ処理の区切り）と「］」（直前に入れたマスクの閉じ）は越えず、ラベルを削らない
+_NAME_MASK_RE = re.compile(r'[^\x1e］]{0,4}?(さん|氏|様|くん|ちゃん)')
+
+_NAME_HINTS = ('さん', '氏', '様', 'くん', 'ちゃん')
 
 def _mask_name_hints(s: str) -> str:
-    out, i = [], 0
-    for m in NAME_HINT_RE.finditer(s):
-        start = max(0, m.start()-4)
-        out.append(s[i:start] + _mask('氏名') + s[m.start():m.end()])
-        i = m.end()
-    out.append(s[i:])
-    return ''.join(out)
+    # 正規表現は先頭の {0,4}? のせいで位置ごとに試行する。敬称の部分文字列検索で当たりが無ければ回さない
+    if not any(h in s for h in _NAME_HINTS):
+        return s
+    return _NAME_MASK_RE.sub(lambda m: MASK_NAME + m.group(1), s)
+
+# どのパターンも「@」「3桁以上続く数字」「://」「敬称」のどれかを必ず含む（郵便・電話は最短でも \d{3} の並びがある）。
+# 1つも無ければ何も伏せる物は無い。日付や個数のような1〜2桁の数字だけの本文もここで素通しになる
+_TRIGGER_RE = re.compile(r'@|\d{3}|://|さん|氏|様|くん|ちゃん')
+# 呼び出しごとに .search の属性引きをしないよう、束縛済みメソッドを持っておく
+_has_trigger = _TRIGGER_RE.search
+
+def _sanitize(text: str) -> str:
+    key = ('@' in text, '://' in text)
+    if text.isascii():
+        # 敬称はどれも非 ASCII なので、氏名の処理も要らない
+        return _MASTERS_B[key].sub(_repl_b, text.encode('ascii')).decode('utf-8')
+    t = _MASTERS[key].sub(_repl, text)
+    t = _mask_name_hints(t)
+    return t
+
+# 同じ本文は一覧・詳細・公開ページで何度も描画されるので結果を覚えておく（純関数なので安全）。
+# 長文はキャッシュを膨らませるだけなので素通しする
+_CACHE_MAX_LEN = 8192
+_sanitize_cached = functools.lru_cache(maxsize=4096)(_sanitize)
 
 def sanitize_public(text: str) -> str:
-    if not text:
+    if not text or not _has_trigger(text):
         return text
-    t = text
-    t = EMAIL_RE.sub(_mask('メール'), t)
-    t = URL_RE.sub(_mask('URL'), t)
-    t = HANDLE_RE.sub(_mask('ハンドル'), t)
-    t = POSTAL_RE.sub(_mask('郵便'), t)
-    t = PHONE_RE.sub(_mask('電話'), t)
-    t = _mask_name_hints(t)
-    return t
\ No newline at end of file
+    if len(text) > _CACHE_MAX_LEN:
+        return _sanitize(text)
+    return _sanitize_cached(text)
+
+# 複数行は区切りでつないで1回でスキャンする。区切りは \x1e を3連にしてあり、
+# どのパターンも \x1e を含めず（電話の区切りは1文字まで）行をまたいで当たらない
+_SEP = '\x1e\x1e\x1e'
+
+def sanitize_public_many(texts):
+    texts = list(texts)
+    # 1行だけ（保存時の add_message 等）は sanitize_public の結果キャッシュに当てる
+    if len(texts) <= 1 or any(not t or '\x1e' in t for t in texts):
+        return [sanitize_public(t) for t in texts]
+    joined = _SEP.join(texts)
+    if not _has_trigger(joined):
+        return texts
+    return _sanitize(joined).split(_SEP)
@@ -0,0 +1,100 @@
+import pytest
+
+import sanitize
+from sanitize import sanitize_public, sanitize_public_many
+
+# 入力 -> 期待する出力
+CASES = [
+    ('連絡は a.b@ex.com まで', '連絡は ［メール］ まで'),
+    ('詳しくは https://ex.com/p?q=1 を参照', '詳しくは ［URL］ を参照'),
+    ('@user_1 の投稿', '［ハンドル］ の投稿'),
+    ('〒100-0001 東京', '［郵便］ 東京'),
+    ('TEL 03-1234-5678', 'TEL ［電話］'),
+    ('TEL ０３-１２３４-５６７８', 'TEL ［電話］'),
+    ('電話: ０９０ １２３４ ５６７８', '電話: ［電話］'),
+    ('〒１００-０００１', '［郵便］'),
+    ('郵便番号100-0001', '郵便番号［郵便］'),
+    # 郵便の形が頭にある電話番号は、全体を電話として伏せる
+    ('090-1234-5678', '［電話］'),
+    ('０９０-１２３４-５６７８', '［電話］'),
+    ('携帯090-1234-5678まで', '携帯［電話］まで'),
+    ('注文番号 123-45678', '注文番号 123-45678'),
+    ('+81 90 1234 5678', '［電話］'),
+    # 日本語に隣接していても境界になる
+    ('電話は03-1234-5678です', '電話は［電話］です'),
+    ('電話は０３-１２３４-５６７８です', '電話は［電話］です'),
+    ('連絡先a@b.comまで', '連絡先［メール］まで'),
+    ('住所は〒１００-０００１です', '住所は［郵便］です'),
+    ('ID abc03-1234 x1234', 'ID abc03-1234 x1234'),
+    # 敬称の前はマスクのラベルを削らない
+    ('a@b.com さん', '［メール］［氏名］さん'),
+    ('a@b.comさん', '［メール］［氏名］さん'),
+    ('03-1234-5678 田中さん', '［電話］［氏名］さん'),
+    ('https://x.jp 様', '［URL］［氏名］様'),
+    ('山田太郎さんと話した', '［氏名］さんと話した'),
+]
+
+
+@pytest.mark.parametrize('src, want', CASES)
+def test_sanitize_public(src, want):
+    assert sanitize_public(src) == want
+
+
+@pytest.mark.parametrize('src', ['', '今日は晴れ', '3月5日に2個'])
+def test_sanitize_public_without_trigger_returns_input(src):
+    assert sanitize_public(src) is src
+
+
+@pytest.mark.parametrize('src, want', CASES)
+def test_sanitize_public_many_matches_single(src, want):
+    assert sanitize_public_many([src, src]) == [want, want]
+    assert sanitize_public_many([src]) == [want]
+
+
+def test_sanitize_public_many_batch():
+    srcs = [src for src, _ in CASES]
+    assert sanitize_public_many(srcs) == [want for _, want in CASES]
+    assert sanitize_public_many(iter(srcs)) == [want for _, want in CASES]
+    assert sanitize_public_many([]) == []
+
+
+@pytest.mark.parametrize('rows', [
+    ['03-1234', '5678'],
+    ['a@b', '.com'],
+    ['〒100', '0001'],
+    ['https:', '//ex.com'],
+    ['今日は晴れ', 'いい天気'],
+])
+def test_sanitize_public_many_does_not_match_across_rows(rows):
+    assert sanitize_public_many(rows) == rows
+
+
+def test_sanitize_public_many_name_prefix_stays_in_row():
+    assert sanitize_public_many(['山田', 'さん']) == ['山田', '［氏名］さん']
+
+
+@pytest.mark.parametrize('rows', [
+    ['TEL\x1e03-1234-5678', 'a@b.com さん'],
+    ['a\x1e\x1e\x1eb', '03-1234-5678'],
+    ['', '03-1234-5678'],
+    [None, '03-1234-5678'],
+])
+def test_sanitize_public_many_falls_back_per_row(rows):
+    # 区切りに使う \x1e を含む行や空の行があるときは1行ずつ処理する
+    assert sanitize_public_many(rows) == [sanitize_public(t) for t in rows]
+
+
+@pytest.mark.parametrize('src', [
+    'a.b@ex.com https://ex.com/p?q=1 @user_1 100-0001 03-1234-5678',
+    'TEL 03-1234-5678 / +81 90 1234 5678',
+    'order 123-45678 or 03-1234-5678',
+])
+def test_bytes_path_matches_str_path(src):
+    # ASCII だけの本文は bytes の正規表現で回る。str の正規表現と同じ結果になること
+    key = ('@' in src, '://' in src)
+    want = sanitize._MASTERS[key].sub(sanitize._repl, src)
+    assert want != src
+    assert sanitize_public(src) == want
+    assert sanitize_public_many([src, src]) == [want, want]
+    # 日本語を足して str の経路に回しても、同じ所が伏せられる
+    assert sanitize_public('あ ' + src) == 'あ ' + want